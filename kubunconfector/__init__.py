@@ -1,13 +1,17 @@
 import json
 from collections import Counter, defaultdict
-from pathlib import Path
+from pathlib import Path, PurePath
 from tempfile import NamedTemporaryFile
-from typing import Dict, Iterator, List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 from zipfile import ZipFile, ZIP_BZIP2
 
-from .kubuntypes import (KubunLink, KubunSelector, KubunString, KubunType,
+from .columnar import ColumnSet
+from .kubuntypes import (FORMAT_COMPACT, FORMAT_PLAIN, CompactCodec, KubunEnum,
+						 KubunLink, KubunSelector, KubunString, KubunType,
 						 Schema, TypeName, LinkTarget)
 from .misc import KubunIdentifier, KubunJSONEncoder
+from .searchindex import SearchIndex
+from .ziptray import RAW_CHUNK_SIZE, ZipTray
 
 
 class KubunNode():
@@ -30,13 +34,21 @@ class KubunNode():
 
 
 class Confector():
-	def __init__(self, archivePath: Path):
+	def __init__(self, archivePath: Path, columnar: bool = False, searchIndex: bool = False, compact: bool = False):
 		self.schemata: Dict[str, Schema] = {}
 		self.archivePath = archivePath
 		self.archiveZip = ZipFile(archivePath, 'w', ZIP_BZIP2)
 		self.tempfiles: Dict[str, NamedTemporaryFile] = {}
 		self.nodeCounter: Counter = Counter()
 		self.schemataChecked = False
+		self.mergedTrays: List[ZipTray] = []
+		self.mergedData: Dict[str, List[ZipTray]] = defaultdict(list)
+		self.columnar = columnar  # Additionally write memory-mappable columns, see columnar.py
+		self.columnSets: Dict[str, ColumnSet] = {}
+		self.searchIndex = searchIndex  # Additionally write a title search index, see searchindex.py
+		self.searchIndices: Dict[str, SearchIndex] = {}
+		self.formatVersion = FORMAT_COMPACT if compact else FORMAT_PLAIN
+		self.codecs: Dict[str, CompactCodec] = {}
 
 	def isReady(self, ignoreSchemataCheck=False):
 		assert self.archiveZip is not None, "Confector is finalized already."
@@ -85,6 +97,7 @@ class Confector():
 				linkToTargetTypeName.update({propertyIdent: targetProp.kubunType})
 
 		self.linkToTargetTypeName = linkToTargetTypeName
+		self.codecs = {tagName: CompactCodec(schema) for tagName, schema in self.schemata.items()}
 		self.schemataChecked = True
 
 	def addNode(self, tagName: str, node: KubunNode):
@@ -95,8 +108,23 @@ class Confector():
 			self.tempfiles.update({tagName: tempfile})
 
 		self.nodeCounter.update({tagName: 1})
-		self.tempfiles[tagName].write(
-			json.dumps(node, cls=KubunJSONEncoder) + "\n")
+		if self.formatVersion == FORMAT_COMPACT:
+			self.tempfiles[tagName].write(
+				json.dumps(self.codecs[tagName].encode(node.toDict()), cls=KubunJSONEncoder) + "\n")
+		else:
+			self.tempfiles[tagName].write(
+				json.dumps(node, cls=KubunJSONEncoder) + "\n")
+
+		if self.columnar:
+			self.getColumnSet(tagName).addNode(node)
+		if self.searchIndex:
+			self.searchIndices.setdefault(tagName, SearchIndex()).addNode(node)
+
+	def getColumnSet(self, tagName: str) -> ColumnSet:
+		if tagName not in self.columnSets.keys():
+			assert tagName in self.schemata, f"Unknown Tag: { tagName }"
+			self.columnSets.update({tagName: ColumnSet(self.schemata[tagName])})
+		return self.columnSets[tagName]
 
 	def addNodes(self, tagName: str, nodes: Iterator[KubunNode]):
 		self.isReady()
@@ -119,21 +147,31 @@ class Confector():
 			else:
 				return
 
+		propertyIdentCasted, expectedType = self.resolveProperty(tagName, propertyIdent)
+		valueCasted = self.castValue(tagName, propertyIdentCasted, expectedType, value)
+		if valueCasted is None:
+			return  # Empty selectors will never be resolved anyway.
+
+		assert propertyIdentCasted not in node.props.keys(), f"Nodes can't have duplicate Properties: PropertyIdent: { propertyIdent }"
+		node.props.update({propertyIdentCasted: valueCasted})
+
+	def resolveProperty(self, tagName: str, propertyIdent: str) -> Tuple[KubunIdentifier, KubunType]:
 		schema = self.schemata.get(tagName)
 		assert schema is not None, f"Unknown Tag: { tagName }"
 
 		propertyIdentCasted = KubunIdentifier(propertyIdent)
 		prop = schema.getProperty(propertyIdentCasted)
-		expectedType = prop.kubunType.expectedPropValue()
+		return propertyIdentCasted, prop.kubunType.expectedPropValue()
 
+	def castValue(self, tagName: str, propertyIdent: KubunIdentifier, expectedType: KubunType, value: any) -> Optional[KubunType]:
 		try:
 			if expectedType is KubunSelector:
 				if not type(value) is list:
 					value = [value]  # KubunSelectors are lists.
 				if len(value) == 0:
-					return  # Empty selectors will never be resolved anyway.
-				
-				targetTypeName = self.linkToTargetTypeName.get(propertyIdentCasted)
+					return None
+
+				targetTypeName = self.linkToTargetTypeName.get(propertyIdent)
 				assert targetTypeName is not None, f"PropertyIdent: { propertyIdent }: Outgoing Link not found in Schema for {tagName}. If it does exist, did you specify a target?"
 				valueCasted = KubunSelector(value, targetTypeName)
 			else:
@@ -145,8 +183,114 @@ class Confector():
 			raise Exception(f"Auto-Casting failed: PropertyIdent: { propertyIdent }, Value: { value }, Casting to: { expectedType }")
 
 		assert type(valueCasted) is expectedType, f"Value has incorrect Type: { type(valueCasted) }; PropertyIdent: { propertyIdent }, Value: { value }, Should be: { expectedType }"
-		assert propertyIdentCasted not in node.props.keys(), f"Nodes can't have duplicate Properties: PropertyIdent: { propertyIdent }"
-		node.props.update({propertyIdentCasted: valueCasted})
+		if expectedType is KubunEnum and self.formatVersion == FORMAT_COMPACT:  # Non-Variants can't be encoded
+			assert self.codecs[tagName].isVariant(propertyIdent, valueCasted), f"Value is not a variant of the Enum: PropertyIdent: { propertyIdent }, Value: { value }"
+		return valueCasted
+
+	def castColumn(self, tagName: str, propertyIdent: str, values: List[any], noNone: bool = False) -> List[Optional[KubunType]]:
+		# Casts all values of one property at once, the schema is only consulted once per column.
+		self.isReady()
+
+		propertyIdentCasted, expectedType = self.resolveProperty(tagName, propertyIdent)
+		if noNone and None in values:
+			raise Exception(f"Got None as value but noNone is set: Property: {propertyIdent}")
+
+		castValue = self.castValue
+		return [
+			None if value is None else castValue(tagName, propertyIdentCasted, expectedType, value)
+			for value in values
+		]
+
+	def addColumns(self, tagName: str, titles: List[List[str]], columns: Dict[str, List[any]],
+				   coverImages: Optional[List[List[str]]] = None, noNone: bool = False):
+		# Bulk-Path: Adds one node per row, columns map property-identifiers to one value per row.
+		self.isReady()
+
+		castedColumns = []
+		for propertyIdent, values in columns.items():
+			assert len(values) == len(titles), f"Column of Property {propertyIdent} has {len(values)} values, expected {len(titles)}"
+			castedColumns.append((KubunIdentifier(propertyIdent), self.castColumn(tagName, propertyIdent, values, noNone)))
+
+		for row, nodeTitles in enumerate(titles):
+			node = KubunNode(nodeTitles, coverImages[row] if coverImages is not None else [])
+			node.props = {
+				ident: values[row] for ident, values in castedColumns if values[row] is not None
+			}
+			self.addNode(tagName, node)
+
+	def mergeArchive(self, archivePath: Path):
+		# Adds the schemata and nodes of a (partial) archive, eg. built on another machine.
+		# Call confector.checkSchemata() afterwards to re-check links across all tags.
+		self.isReady(True)
+
+		tray = ZipTray(archivePath, 'r')
+		self.mergedTrays.append(tray)
+		assert tray.formatVersion() == self.formatVersion, f"Archive {archivePath} uses format {tray.formatVersion()}, expected {self.formatVersion}."
+
+		for schemaPath, schemaData in tray.globAndLoad("schemata/*.json"):
+			tagName = PurePath(schemaPath).stem
+			schema = Schema(schemaData)
+			if tagName in self.schemata:
+				assert self.schemata[tagName].toDict() == schema.toDict(), f"Schema of tag {tagName} in {archivePath} differs from the one already registered."
+			else:
+				self.registerSchema(tagName, schema)
+
+		nodeCounts = tray.readMeta().get("node_counts", {})
+		for dataPath in tray.glob("data/*.json"):
+			tagName = PurePath(dataPath).stem
+			assert tagName in self.schemata, f"Archive {archivePath} contains data for tag {tagName}, but no schema."
+			self.mergedData[tagName].append(tray)
+			if (count := nodeCounts.get(tagName)) is None:
+				count = tray.countLines(dataPath)  # Older archives don't record their node counts
+			self.nodeCounter.update({tagName: count})
+
+		self.schemataChecked = False
+
+	def writeData(self, tagName: str):
+		dataPath = f"data/{tagName}.json"
+		datafile = self.tempfiles.get(tagName)
+		trays = self.mergedData.get(tagName, [])
+
+		if len(trays) == 0:
+			datafile.seek(0)
+			self.archiveZip.writestr(dataPath, datafile.read())
+		elif len(trays) == 1 and datafile is None and trays[0].copyRawFile(dataPath, self.archiveZip):
+			pass  # Copied without recompressing
+		else:
+			# Concatenated BZIP2-Streams can't be read by zipfile, we have to recompress
+			# Our own nodes come first, so that they match the rows of the ColumnSet.
+			with self.archiveZip.open(dataPath, 'w', force_zip64=True) as target:
+				if datafile is not None:
+					datafile.seek(0)
+					while chunk := datafile.read(RAW_CHUNK_SIZE):
+						target.write(chunk.encode())
+				for tray in trays:
+					with tray.openFile(dataPath) as source:
+						while chunk := source.read(RAW_CHUNK_SIZE):
+							target.write(chunk)
+
+		if datafile is not None:
+			datafile.close()
+
+		columnSet = self.getColumnSet(tagName) if self.columnar else None
+		searchIndex = self.searchIndices.setdefault(tagName, SearchIndex()) if self.searchIndex else None
+
+		if columnSet is not None or searchIndex is not None:
+			for tray in trays:
+				with tray.openFile(dataPath) as source:
+					for line in source:
+						nodeData = json.loads(line)
+						if self.formatVersion == FORMAT_COMPACT:
+							nodeData = self.codecs[tagName].decode(nodeData)
+						if columnSet is not None:
+							columnSet.addRow(nodeData)
+						if searchIndex is not None:
+							searchIndex.addTitles(nodeData['titles'])
+
+		if columnSet is not None:
+			columnSet.writeTo(self.archiveZip, tagName)
+		if searchIndex is not None:
+			searchIndex.writeTo(self.archiveZip, tagName)
 
 	def pretty_print(self): # I'll admit: It's not that pretty haha
 
@@ -176,12 +320,17 @@ class Confector():
 		for tagName, count in self.nodeCounter.most_common():
 			print(f"{ tagName.ljust(40) } -> wrote { count } nodes.")
 
-		for tagName, datafile in self.tempfiles.items():
-			datafile.seek(0)
-			self.archiveZip.writestr(f"data/{tagName}.json", datafile.read())
-			datafile.close()
+		for tagName in dict.fromkeys([*self.tempfiles.keys(), *self.mergedData.keys()]):
+			self.writeData(tagName)
+
+		for tray in self.mergedTrays:
+			tray.close()
 
-		self.archiveZip.writestr("meta.json", json.dumps(metaData))  # TODO: Attribution as class / typeddict
+		self.archiveZip.writestr("meta.json", json.dumps({
+			**metaData,
+			"format_version": self.formatVersion,
+			"node_counts": dict(self.nodeCounter)
+		}))  # TODO: Attribution as class / typeddict
 
 		print("\nArchive Contents:")
 		self.archiveZip.printdir()
@@ -0,0 +1,125 @@
+import argparse
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from . import Confector, Schema
+
+CHUNK_SIZE = 10000  # Rows read and cast at once
+
+BOOL_STRINGS = {
+	'1': True, 'true': True, 'yes': True,
+	'0': False, 'false': False, 'no': False
+}
+
+
+def parseBool(value: str) -> bool:
+	try:
+		return BOOL_STRINGS[value.strip().lower()]
+	except KeyError:
+		raise ValueError(f"Not a boolean: {value}")
+
+
+# Scalar types that can be cast from a single CSV-cell. List-like types would be split into characters.
+CSV_TYPES = {
+	'KubunInt', 'KubunFloat', 'KubunString', 'KubunTextArea', 'KubunURL',
+	'KubunEnum', 'KubunBool', 'KubunDate', 'KubunLink'
+}
+
+# CSV only knows strings, most KubunTypes can cast those themselves.
+CSV_PARSERS = {
+	'KubunBool': parseBool,
+	'KubunDate': float,  # Timestamp
+}
+
+
+def readChunks(sourcePath: Path, delimiter: str, chunkSize: int) -> Iterator[Dict[str, List[str]]]:
+	# Yields the source in chunks of columns: {columnName: [value, ...]}
+	with open(sourcePath, newline='') as fo:
+		reader = csv.reader(fo, delimiter=delimiter)
+		try:
+			header = next(reader)
+		except StopIteration:
+			raise Exception(f"{sourcePath} is empty, expected a header row.")
+
+		def rows():  # Like DictReader: Skips blank lines, pads short rows (empty values are None later on)
+			for row in reader:
+				if len(row) == 0:
+					continue
+				if len(row) > len(header):
+					raise Exception(f"{sourcePath}, line {reader.line_num}: Row has {len(row)} fields, header only {len(header)}")
+				yield row + [''] * (len(header) - len(row))
+
+		rowIterator = rows()
+		while chunk := list(islice(rowIterator, chunkSize)):
+			yield dict(zip(header, map(list, zip(*chunk))))
+
+
+def buildTag(confector, tagName: str, tagMapping: dict, baseDir: Path, chunkSize: int):
+	schema = confector.schemata[tagName]
+	titleColumn = tagMapping['title']
+	coverColumn = tagMapping.get('cover')
+	properties: Dict[str, str] = tagMapping.get('properties', {})
+	for ident in properties.keys():
+		typeName = schema.getProperty(ident).typeName
+		if typeName not in CSV_TYPES:
+			raise Exception(f"Tag {tagName}: Property {ident} is a {typeName}, which can't be read from a CSV-column.")
+
+	parsers = {
+		ident: CSV_PARSERS.get(schema.getProperty(ident).typeName) for ident in properties.keys()
+	}
+
+	for chunk in readChunks(baseDir / tagMapping['source'], tagMapping.get('delimiter', ','), chunkSize):
+		for columnName in [titleColumn, coverColumn, *properties.values()]:
+			assert columnName is None or columnName in chunk, f"Tag {tagName}: Column {columnName} not found in {tagMapping['source']}"
+
+		titles = [[title] for title in chunk[titleColumn]]
+		coverImages = None
+		if coverColumn is not None:
+			coverImages = [[cover] if cover else [] for cover in chunk[coverColumn]]
+
+		columns = {}
+		for ident, columnName in properties.items():
+			parser = parsers[ident]
+			columns[ident] = [
+				None if value == '' else (value if parser is None else parser(value))
+				for value in chunk[columnName]
+			]
+
+		confector.addColumns(tagName, titles, columns, coverImages)
+
+
+def build(args: argparse.Namespace):
+	mapping = json.loads(args.mapping.read_text())
+	baseDir = args.mapping.parent
+	target = args.target or baseDir / mapping['target']
+
+	confector = Confector(target, columnar=args.columnar, searchIndex=args.search_index, compact=args.compact)
+	for tagName, tagMapping in mapping['tags'].items():
+		confector.registerSchema(tagName, Schema.fromFile(baseDir / tagMapping['schema']))
+	confector.checkSchemata()
+
+	for tagName, tagMapping in mapping['tags'].items():
+		if tagMapping.get('source') is not None:
+			buildTag(confector, tagName, tagMapping, baseDir, args.chunk_size)
+
+	confector.finalize(mapping.get('meta', {}))
+
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(prog='kubunconfector', description='Kubun Data-Preparation Utility')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	buildParser = subparsers.add_parser('build', help='Build an archive from CSV-Files as described by a mapping file.')
+	buildParser.add_argument('mapping', type=Path, help='Mapping file (JSON), see example/example_mapping.json')
+	buildParser.add_argument('--target', type=Path, help='Archive to create, overrides "target" of the mapping file.')
+	buildParser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows read and cast at once.')
+	buildParser.add_argument('--columnar', action='store_true', help='Also write memory-mappable columns.')
+	buildParser.add_argument('--search-index', action='store_true', help='Also write a title search index.')
+	buildParser.add_argument('--compact', action='store_true', help='Use the compact encoding for enums and selectors.')
+	buildParser.set_defaults(func=build)
+
+	args = parser.parse_args(argv)
+	args.func(args)
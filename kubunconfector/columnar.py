@@ -0,0 +1,169 @@
+import io
+import json
+import shutil
+import struct
+import sys
+import time
+from array import array
+from tempfile import TemporaryFile
+from typing import Dict, Optional
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP64_LIMIT
+
+from .kubuntypes import (KubunBool, KubunDate, KubunEnum, KubunFloat, KubunInt,
+						 KubunString, KubunType, Property, Schema)
+
+COLUMN_ALIGNMENT = 64  # Bytes, enough for any dtype and SIMD-Loads
+ALIGNMENT_EXTRA_ID = 0xD935  # Same Extra-Field as Android's zipalign uses for padding
+FLUSH_EVERY = 1 << 16  # Values buffered per column before they are written to the tempfile
+
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def toInt64(value) -> int:
+	value = int(value)
+	if not INT64_MIN <= value <= INT64_MAX:
+		raise OverflowError(f"Out of int64 range: {value}")
+	return value
+
+
+def toBool(value) -> bool:  # KubunBool keeps whatever it was given, only accept actual booleans (or 0 / 1)
+	if value is True or value is False or value in (0, 1):
+		return bool(value)
+	raise ValueError(f"Not a boolean: {value}")
+
+
+# KubunType -> (array-typecode, numpy-dtype, conversion); Values are always stored little-endian
+FIXED_WIDTH_COLUMNS = {
+	KubunInt: ('q', '<i8', toInt64),
+	KubunFloat: ('d', '<f8', float),
+	KubunDate: ('q', '<i8', toInt64),  # Seconds since epoch, see KubunDate.toDict()
+	KubunBool: ('B', '|b1', toBool),
+}
+
+# Dictionary-encoded: Values are indices into a list of distinct strings
+DICTIONARY_COLUMNS = (KubunEnum, KubunString)
+DICTIONARY_CODE = ('I' if array('I').itemsize == 4 else 'L', '<u4', None)
+
+
+def isColumnar(prop: Property) -> bool:
+	return prop.ident is not None and (prop.kubunType in FIXED_WIDTH_COLUMNS or prop.kubunType in DICTIONARY_COLUMNS)
+
+
+def plainValue(value: KubunType):  # Same representation as in the NDJSON-Data
+	if isinstance(value, (KubunBool, KubunDate)):
+		return value.toDict()
+	return value
+
+
+def writeAligned(archive: ZipFile, filePath: str, fob, size: int):
+	# Stores a member uncompressed, its data starting at a multiple of COLUMN_ALIGNMENT,
+	# so that readers can memory-map the archive and use the member in place.
+	info = ZipInfo(filePath, date_time=time.localtime(time.time())[:6])
+	info.compress_type = ZIP_STORED
+	info.file_size = size
+	info.compress_size = info.CRC = 0  # Set by ZipFile once written
+	info.external_attr = 0o600 << 16
+
+	zip64 = size * 1.05 > ZIP64_LIMIT  # Same decision as ZipFile.open(..., 'w')
+	headerSize = len(info.FileHeader(zip64)) + 4  # + Header of the padding Extra-Field
+	padding = -(archive.start_dir + headerSize) % COLUMN_ALIGNMENT
+	info.extra = struct.pack('<HH', ALIGNMENT_EXTRA_ID, padding) + bytes(padding)
+
+	with archive.open(info, 'w') as target:
+		shutil.copyfileobj(fob, target)
+
+
+class Column():
+	def __init__(self, prop: Property):
+		self.prop = prop
+
+		if prop.kubunType in DICTIONARY_COLUMNS:
+			self.dictionary: Optional[Dict[str, int]] = {}
+			self.typecode, self.dtype, self.convert = DICTIONARY_CODE
+		else:
+			self.dictionary = None
+			self.typecode, self.dtype, self.convert = FIXED_WIDTH_COLUMNS[prop.kubunType]
+
+		self.values = TemporaryFile()
+		self.buffer = array(self.typecode)
+		self.validity = bytearray()  # One bit per row, least significant bit first
+		self.rows = 0
+
+	def append(self, value):
+		if self.rows % 8 == 0:
+			self.validity.append(0)
+
+		if value is None:
+			self.buffer.append(0)
+		else:
+			if self.dictionary is not None:
+				code = self.dictionary.setdefault(value, len(self.dictionary))
+			else:
+				try:
+					code = self.convert(value)
+				except (TypeError, ValueError, OverflowError):
+					raise Exception(f"Columnar export failed: PropertyIdent: { self.prop.ident }, Value: { value }, Column: { self.dtype }")
+			self.buffer.append(code)
+			self.validity[-1] |= 1 << (self.rows % 8)
+
+		self.rows += 1
+		if len(self.buffer) >= FLUSH_EVERY:
+			self.flush()
+
+	def flush(self):
+		if sys.byteorder == 'big':
+			self.buffer.byteswap()
+		self.buffer.tofile(self.values)
+		self.buffer = array(self.typecode)
+
+	def writeTo(self, archive: ZipFile, prefix: str) -> dict:
+		self.flush()
+
+		size = self.values.tell()
+		self.values.seek(0)
+		writeAligned(archive, f"{prefix}.values", self.values, size)
+		self.values.close()
+
+		self.validity.extend(bytes(-len(self.validity) % 8))  # Pad to full 64 bit words
+		writeAligned(archive, f"{prefix}.validity", io.BytesIO(self.validity), len(self.validity))
+
+		dictionaryPath = None
+		if self.dictionary is not None:
+			dictionaryPath = f"{prefix}.dictionary.json"
+			archive.writestr(dictionaryPath, json.dumps(list(self.dictionary.keys())))
+
+		return {
+			"type": self.prop.typeName,
+			"dtype": self.dtype,
+			"values": f"{prefix}.values",
+			"validity": f"{prefix}.validity",
+			"dictionary": dictionaryPath
+		}
+
+
+class ColumnSet():
+	# Columnar copy of a tag's nodes: Row i belongs to line i of data/{tagName}.json
+	def __init__(self, schema: Schema):
+		self.columns: Dict[str, Column] = {
+			str(p.ident): Column(p) for p in schema.main.collect() if isColumnar(p)
+		}
+		self.rows = 0
+
+	def addRow(self, nodeData: dict):  # As serialized in data/{tagName}.json
+		for ident, column in self.columns.items():
+			column.append(nodeData.get(ident))
+		self.rows += 1
+
+	def addNode(self, node):
+		self.addRow({str(i): plainValue(v) for i, v in node.props.items()})
+
+	def writeTo(self, archive: ZipFile, tagName: str):
+		prefix = f"columns/{tagName}"
+		archive.writestr(f"{prefix}/index.json", json.dumps({
+			"rows": self.rows,
+			"alignment": COLUMN_ALIGNMENT,
+			"columns": {
+				ident: column.writeTo(archive, f"{prefix}/{ident}")
+				for ident, column in self.columns.items()
+			}
+		}))
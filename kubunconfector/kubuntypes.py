@@ -4,8 +4,7 @@ from __future__ import \
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Generator, List, Literal, NewType, Optional, Type, TypedDict
-import typeguard
+from typing import Dict, Generator, List, Literal, NewType, Optional, Set, Type, TypedDict
 
 from .misc import KubunIdentifier
 
@@ -28,6 +27,8 @@ class ConfigSet():
 			raise Exception(f"ConfigSet: Parameter {paramName} not found.")
 
 	def checkConfig(self, configData: dict, paramName: str):
+		import typeguard  # Imported lazily, keeps startup fast when nothing is validated
+
 		for line in self.configLines:
 			configParam = configData.get(line.name)
 
@@ -123,12 +124,16 @@ class KubunFloat(float, KubunType):
 
 class KubunSelector(KubunType):
 	def __init__(self, subValues: List[any], subType: KubunType) -> KubunSelector:
+		self.subType = subType
 		self.subValues = list(map(subType, subValues))
 		assert len(subValues) > 0
 
 	def toDict(self):
 		return [{'type': s.__class__.__name__, 'value': s} for s in self.subValues]
 
+	def toCompactDict(self):  # All subValues share their type, see CompactCodec
+		return {'type': self.subType.__name__, 'values': self.subValues}
+
 
 class KubunString(str, KubunType):
 	pass
@@ -416,6 +421,49 @@ class Schema():
 		return "<Schema>"
 
 
+# Encoding of the nodes in data/*.json, stored as "format_version" in meta.json
+FORMAT_PLAIN = 1
+FORMAT_COMPACT = 2
+
+
+class CompactCodec():
+	# FORMAT_COMPACT: KubunEnums are stored as index into their variants,
+	# KubunSelectors as {"type": "KubunInt", "values": [1, 2]} instead of one object per subValue.
+	def __init__(self, schema: Schema):
+		self.variantIndices: Dict[str, Dict[str, int]] = {}
+		self.variants: Dict[str, List[str]] = {}
+		self.selectors: Set[str] = set()
+
+		for p in schema.main.collect():
+			if p.kubunType is KubunEnum:
+				variants = p.config['variants']
+				self.variants.update({str(p.ident): variants})
+				self.variantIndices.update({str(p.ident): {v: i for i, v in enumerate(variants)}})
+			elif p.kubunType.expectedPropValue() is KubunSelector:
+				self.selectors.add(str(p.ident))
+
+	def isVariant(self, propertyIdent: KubunIdentifier, value: str) -> bool:
+		return value in self.variantIndices[str(propertyIdent)]
+
+	def encode(self, nodeData: dict) -> dict:  # Expects KubunNode.toDict()
+		for ident, indices in self.variantIndices.items():
+			if ident in nodeData:
+				nodeData[ident] = indices[nodeData[ident]]
+		for ident in self.selectors:
+			if ident in nodeData:
+				nodeData[ident] = nodeData[ident].toCompactDict()
+		return nodeData
+
+	def decode(self, nodeData: dict) -> dict:  # Deserialized JSON, returns it as in FORMAT_PLAIN
+		for ident, variants in self.variants.items():
+			if ident in nodeData:
+				nodeData[ident] = variants[nodeData[ident]]
+		for ident in self.selectors:
+			if (selector := nodeData.get(ident)) is not None:
+				nodeData[ident] = [{'type': selector['type'], 'value': v} for v in selector['values']]
+		return nodeData
+
+
 # TODO:
 # KubunYoutubeVideo -> Embeds a YT-Video
 # KubunSplitPane -> Structural Element, Side-by-side view
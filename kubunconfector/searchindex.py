@@ -0,0 +1,219 @@
+import heapq
+import json
+import sys
+import unicodedata
+from array import array
+from tempfile import TemporaryFile
+from typing import Dict, Iterator, List, Tuple
+from zipfile import ZipFile
+
+from .columnar import DICTIONARY_CODE, writeAligned
+
+SPILL_EVERY = 1 << 18  # Pairs kept in memory before a sorted run is spilled to a tempfile
+PREFIX_LENGTH = 2  # Characters, titles are grouped into prefix ranges by their first characters
+UINT32 = DICTIONARY_CODE[0]
+
+# Layout of search/{tagName}/, all integer arrays are little-endian uint32 and uncompressed:
+#   titles.utf8, title_lengths             Sorted, normalized, distinct titles; Byte-Length of each
+#   title_node_counts, title_nodes         Rows in data/{tagName}.json per title; Per title ascending,
+#                                          delta-encoded to the previous row of the same title
+#   prefixes.utf8, prefix_lengths          Distinct title-prefixes (sorted); Byte-Length of each
+#   prefix_title_counts                    Number of titles per prefix, ranges are consecutive
+#   trigrams.utf8, trigram_lengths         Sorted, distinct trigrams of f" {title} "; Byte-Length of each
+#   trigram_title_counts, trigram_titles   Titles per trigram; Per trigram ascending title-ids,
+#                                          delta-encoded to the previous id of the same trigram
+# Lengths and counts are deltas of offsets as well, a cumulative sum yields the end of each entry.
+
+
+def normalizeTitle(title: str) -> str:  # "Crème  Brûlée" -> "creme brulee"
+	decomposed = unicodedata.normalize('NFKD', str(title).casefold())
+	stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+	return ' '.join(stripped.split())
+
+
+def titleTrigrams(title: str) -> List[str]:
+	padded = f" {title} "
+	return sorted(set(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+class SpillSorter():
+	# Sorts (str, int)-Pairs with bounded memory: Sorted runs are spilled to tempfiles and merged lazily.
+	# Keys must not contain tabs or newlines, normalized titles never do.
+	def __init__(self):
+		self.buffer: List[Tuple[str, int]] = []
+		self.runs = []
+
+	def add(self, key: str, value: int):
+		self.buffer.append((key, value))
+		if len(self.buffer) >= SPILL_EVERY:
+			self.spill()
+
+	def spill(self):
+		if len(self.buffer) == 0:
+			return
+		self.buffer.sort()
+		run = TemporaryFile('w+', encoding='utf-8')
+		run.writelines(f"{key}\t{value}\n" for key, value in self.buffer)
+		run.seek(0)
+		self.runs.append(run)
+		self.buffer = []
+
+	@staticmethod
+	def readRun(run) -> Iterator[Tuple[str, int]]:
+		for line in run:
+			key, value = line.rstrip('\n').rsplit('\t', 1)
+			yield key, int(value)
+		run.close()
+
+	def sorted(self) -> Iterator[Tuple[str, int]]:
+		self.spill()
+		runs, self.runs = self.runs, []
+		return heapq.merge(*map(self.readRun, runs))
+
+
+class UInt32Array():
+	def __init__(self):
+		self.data = TemporaryFile()
+		self.buffer = array(UINT32)
+		self.length = 0
+
+	def append(self, value: int):
+		self.buffer.append(value)
+		self.length += 1
+		if len(self.buffer) >= SPILL_EVERY:
+			self.flush()
+
+	def flush(self):
+		if sys.byteorder == 'big':
+			self.buffer.byteswap()
+		self.buffer.tofile(self.data)
+		self.buffer = array(UINT32)
+
+	def writeTo(self, archive: ZipFile, filePath: str) -> dict:
+		self.flush()
+		size = self.data.tell()
+		self.data.seek(0)
+		writeAligned(archive, filePath, self.data, size)
+		self.data.close()
+		return {"path": filePath, "dtype": "<u4"}
+
+
+class StringArray():  # Concatenated UTF-8 plus the Byte-Length of each string
+	def __init__(self):
+		self.data = TemporaryFile()
+		self.lengths = UInt32Array()
+
+	def append(self, value: str):
+		encoded = value.encode('utf-8')
+		self.data.write(encoded)
+		self.lengths.append(len(encoded))
+
+	def writeTo(self, archive: ZipFile, filePath: str, lengthsPath: str) -> Dict[str, dict]:
+		size = self.data.tell()
+		self.data.seek(0)
+		writeAligned(archive, filePath, self.data, size)
+		self.data.close()
+		return {
+			filePath: {"path": filePath, "dtype": "|u1"},
+			lengthsPath: self.lengths.writeTo(archive, lengthsPath)
+		}
+
+
+class PostingList():  # Groups sorted (key, id)-Pairs into keys, counts and delta-encoded ids
+	def __init__(self):
+		self.keys = StringArray()
+		self.counts = UInt32Array()
+		self.ids = UInt32Array()
+		self.currentKey = None
+		self.count = 0
+		self.lastId = 0
+
+	def add(self, key: str, id: int):
+		if key != self.currentKey:
+			self.finishKey()
+			self.keys.append(key)
+			self.currentKey = key
+			self.lastId = 0
+		elif id == self.lastId:
+			return  # Duplicate pair
+		self.ids.append(id - self.lastId)
+		self.lastId = id
+		self.count += 1
+
+	def finishKey(self):
+		if self.currentKey is not None:
+			self.counts.append(self.count)
+		self.count = 0
+
+
+class SearchIndex():
+	# Title search index of a tag: Row i belongs to line i of data/{tagName}.json
+	def __init__(self):
+		self.titles = SpillSorter()
+		self.rows = 0
+
+	def addTitles(self, titles: List[str]):
+		for title in set(map(normalizeTitle, titles)):
+			if title:
+				self.titles.add(title, self.rows)
+		self.rows += 1
+
+	def addNode(self, node):
+		self.addTitles(node.titles)
+
+	def writeTo(self, archive: ZipFile, tagName: str):
+		prefix = f"search/{tagName}"
+
+		titleNodes = PostingList()
+		prefixes = StringArray()
+		prefixTitleCounts = UInt32Array()
+		trigrams = SpillSorter()
+
+		titleId = -1
+		currentPrefix = None
+		prefixCount = 0
+		for title, row in self.titles.sorted():
+			if title != titleNodes.currentKey:
+				titleId += 1
+				for trigram in titleTrigrams(title):
+					trigrams.add(trigram, titleId)
+
+				if title[:PREFIX_LENGTH] != currentPrefix:
+					if currentPrefix is not None:
+						prefixTitleCounts.append(prefixCount)
+					currentPrefix = title[:PREFIX_LENGTH]
+					prefixes.append(currentPrefix)
+					prefixCount = 0
+				prefixCount += 1
+
+			titleNodes.add(title, row)
+
+		titleNodes.finishKey()
+		if currentPrefix is not None:
+			prefixTitleCounts.append(prefixCount)
+
+		trigramTitles = PostingList()
+		for trigram, id in trigrams.sorted():
+			trigramTitles.add(trigram, id)
+		trigramTitles.finishKey()
+
+		arrays = {
+			**titleNodes.keys.writeTo(archive, f"{prefix}/titles.utf8", f"{prefix}/title_lengths"),
+			f"{prefix}/title_node_counts": titleNodes.counts.writeTo(archive, f"{prefix}/title_node_counts"),
+			f"{prefix}/title_nodes": titleNodes.ids.writeTo(archive, f"{prefix}/title_nodes"),
+			**prefixes.writeTo(archive, f"{prefix}/prefixes.utf8", f"{prefix}/prefix_lengths"),
+			f"{prefix}/prefix_title_counts": prefixTitleCounts.writeTo(archive, f"{prefix}/prefix_title_counts"),
+			**trigramTitles.keys.writeTo(archive, f"{prefix}/trigrams.utf8", f"{prefix}/trigram_lengths"),
+			f"{prefix}/trigram_title_counts": trigramTitles.counts.writeTo(archive, f"{prefix}/trigram_title_counts"),
+			f"{prefix}/trigram_titles": trigramTitles.ids.writeTo(archive, f"{prefix}/trigram_titles"),
+		}
+
+		archive.writestr(f"{prefix}/index.json", json.dumps({
+			"rows": self.rows,
+			"titles": titleId + 1,
+			"trigrams": trigramTitles.keys.lengths.length,
+			"prefixLength": PREFIX_LENGTH,
+			"arrays": {
+				filePath[len(prefix) + 1:]: member for filePath, member in arrays.items()
+			}
+		}))
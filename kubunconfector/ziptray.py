@@ -1,32 +1,247 @@
-from zipfile import ZipFile, ZIP_BZIP2, Path as ZipPath
+from zipfile import ZipFile, ZIP_BZIP2, ZIP_STORED, ZIP64_LIMIT, Path as ZipPath
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+import copy
 import json
+import mmap
+import struct
+import threading
+import weakref
+
+from .kubuntypes import FORMAT_COMPACT, FORMAT_PLAIN, CompactCodec, Schema
+
+RAW_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Local File Header, see the ZIP-Specification (APPNOTE.TXT, 4.3.7)
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_NAME_LENGTHS = struct.Struct('<HH')  # Filename- and Extra-Field-Length, at offset 26
+USE_DATA_DESCRIPTOR = 0x08  # General Purpose Bit 3
+ZIP64_EXTRA_ID = 0x0001
+
+# zipfile has no public API to add already compressed members, copyRawFile() relies on these internals
+RAW_COPY_INTERNALS = ('fp', '_lock', '_writing', '_seekable', '_writecheck', '_didModify', 'start_dir')
+
+processArchives = {}  # archivePath -> ZipFile, one read-only handle per worker process
 
-class ZipTray():
 
+def loadInProcess(archivePath, filePath):
+    if (archive := processArchives.get(archivePath)) is None:
+        archive = processArchives[archivePath] = ZipFile(archivePath, 'r')
+    with archive.open(str(filePath)) as fob:
+        return filePath, json.load(fob)
+
+
+def stripZip64Extra(extra):  # Removes the ZIP64 Extra-Field, keeps all others
+    stripped = b''
+    i = 0
+    while i + 4 <= len(extra):
+        xid, xlen = struct.unpack('<HH', extra[i:i + 4])
+        if xid != ZIP64_EXTRA_ID:
+            stripped += extra[i:i + 4 + xlen]
+        i += 4 + xlen
+    return stripped
+
+
+class ThreadHandle():  # Held in a ZipTray's thread-local only, closes its ZipFile once the thread is gone
     def __init__(self, archivePath):
-        self.archive = ZipFile(archivePath, 'a', ZIP_BZIP2)
+        self.archive = ZipFile(archivePath, 'r')
+        weakref.finalize(self, self.archive.close)
+
+
+class ZipTray():
+
+    def __init__(self, archivePath, mode='a'):
+        # mode 'r' is read-only and safe to share across threads: Each thread reads through its own file handle.
+        assert mode in ('a', 'r'), f"ZipTray: Unsupported mode {mode}"
+        self.archivePath = archivePath
+        self.mode = mode
+        self.archive = ZipFile(archivePath, mode, ZIP_BZIP2)
+        self.mapped = None
+        self.local = threading.local()
+        self.handles = weakref.WeakSet()  # ThreadHandles of threads still alive, for close()
+
+    def threadArchive(self):  # ZipFile to read from in the current thread
+        if self.mode != 'r' or threading.current_thread() is threading.main_thread():
+            return self.archive
+        if (handle := getattr(self.local, 'handle', None)) is None:
+            handle = self.local.handle = ThreadHandle(self.archivePath)
+            self.handles.add(handle)
+        return handle.archive
+
+    def openWorkerArchive(self, workerHandles):  # Thread-Pool initializer: One handle per worker thread
+        workerHandles.append(self.threadArchive())
 
     def writeFile(self, filePath, dataDict):
         self.archive.writestr(str(filePath), json.dumps(dataDict, indent=4, sort_keys=False))
     
     def readFile(self, filePath):
-        with self.archive.open(str(filePath)) as fob:
+        with self.openFile(filePath) as fob:
             return json.load(fob)
     
+    def readMeta(self):
+        if not self.fileExists("meta.json"):
+            return {}
+        return self.readFile("meta.json")
+
+    def formatVersion(self):  # Archives without a format_version predate FORMAT_COMPACT
+        return self.readMeta().get("format_version", FORMAT_PLAIN)
+
+    def iterNodes(self, tagName):  # Yields the nodes of a tag as in FORMAT_PLAIN, whatever the archive uses
+        codec = None
+        if self.formatVersion() == FORMAT_COMPACT:
+            codec = CompactCodec(Schema(self.readFile(f"schemata/{tagName}.json")))
+
+        with self.openFile(f"data/{tagName}.json") as fob:
+            for line in fob:
+                nodeData = json.loads(line)
+                yield nodeData if codec is None else codec.decode(nodeData)
+
+    def openFile(self, filePath):
+        return self.threadArchive().open(str(filePath))
+
+    def countLines(self, filePath):  # NDJSON-Members: One node per line
+        lines = 0
+        with self.openFile(filePath) as fob:
+            while chunk := fob.read(RAW_CHUNK_SIZE):
+                lines += chunk.count(b"\n")
+        return lines
+
+    def dataOffset(self, info):  # Position of a member's (compressed) data within the archive
+        with self.archive._lock:
+            self.archive.fp.seek(info.header_offset)
+            header = self.archive.fp.read(LOCAL_HEADER_SIZE)
+        nameLength, extraLength = LOCAL_HEADER_NAME_LENGTHS.unpack(header[26:30])
+        return info.header_offset + LOCAL_HEADER_SIZE + nameLength + extraLength
+
+    def iterRawFile(self, filePath):  # Yields the still compressed bytes of a member
+        info = self.archive.getinfo(str(filePath))
+        offset = self.dataOffset(info)
+        with self.archive._lock:
+            fp = self.archive.fp
+            fp.seek(offset)
+            left = info.compress_size
+            while left > 0:
+                chunk = fp.read(min(left, RAW_CHUNK_SIZE))
+                assert len(chunk) > 0, f"Truncated member in archive: {filePath}"
+                left -= len(chunk)
+                yield chunk
+
+    def canCopyRaw(self, targetArchive: ZipFile):
+        return all(hasattr(archive, attr) for archive in (self.archive, targetArchive) for attr in RAW_COPY_INTERNALS)
+
+    def copyRawFile(self, filePath, targetArchive: ZipFile):
+        # Copies a member into another archive without decompressing and recompressing it.
+        # zipfile has no public API for this, so we mirror what ZipFile.open(..., 'w') does.
+        # Returns False if this zipfile lacks the internals we need, nothing is written then.
+        if not self.canCopyRaw(targetArchive):
+            return False
+
+        info = copy.copy(self.archive.getinfo(str(filePath)))
+        info.flag_bits &= ~USE_DATA_DESCRIPTOR  # CRC and sizes are known upfront
+        info.extra = stripZip64Extra(info.extra)  # ZIP64-Header gets rewritten by FileHeader()
+        zip64 = info.file_size > ZIP64_LIMIT or info.compress_size > ZIP64_LIMIT
+
+        assert not targetArchive._writing, "Target archive has another write handle open."
+        with targetArchive._lock:
+            if targetArchive._seekable:
+                targetArchive.fp.seek(targetArchive.start_dir)
+            info.header_offset = targetArchive.fp.tell()
+            targetArchive._writecheck(info)
+            targetArchive._didModify = True
+            targetArchive.fp.write(info.FileHeader(zip64))
+
+            for chunk in self.iterRawFile(filePath):
+                targetArchive.fp.write(chunk)
+
+            targetArchive.start_dir = targetArchive.fp.tell()
+            targetArchive.filelist.append(info)
+            targetArchive.NameToInfo[info.filename] = info
+        return True
+
+    def mapFile(self, filePath):  # Zero-copy view on an uncompressed member
+        info = self.archive.getinfo(str(filePath))
+        assert info.compress_type == ZIP_STORED, f"Only uncompressed members can be mapped: {filePath}"
+        offset = self.dataOffset(info)
+
+        if self.mapped is None or len(self.mapped) < offset + info.file_size:
+            self.archive.fp.flush()
+            self.mapped = mmap.mmap(self.archive.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.mapped)[offset:offset + info.file_size]
+
+    def loadColumn(self, tagName, propertyIdent):
+        # Loads a column written by Confector(..., columnar=True) as (values, validity, dictionary).
+        # For KubunEnum / KubunString, values are indices into dictionary, otherwise dictionary is None.
+        import numpy as np  # Optional dependency, only needed for columnar access
+
+        index = self.readFile(f"columns/{tagName}/index.json")
+        column = index['columns'][str(propertyIdent)]
+        rows = index['rows']
+
+        values = np.frombuffer(self.mapFile(column['values']), dtype=column['dtype'], count=rows)
+        validityBits = np.frombuffer(self.mapFile(column['validity']), dtype=np.uint8)
+        validity = np.unpackbits(validityBits, count=rows, bitorder='little').view(bool)
+
+        dictionary = None
+        if column['dictionary'] is not None:
+            dictionary = self.readFile(column['dictionary'])
+        return values, validity, dictionary
+
+    def loadSearchIndex(self, tagName):
+        # Maps the arrays written by Confector(..., searchIndex=True), see searchindex.py for their layout
+        import numpy as np  # Optional dependency, see loadColumn()
+
+        index = self.readFile(f"search/{tagName}/index.json")
+        return index, {
+            name: np.frombuffer(self.mapFile(member['path']), dtype=member['dtype'])
+            for name, member in index['arrays'].items()
+        }
+
     def glob(self, pattern):
         from pathlib import PurePath
         for filePath in self.archive.filelist:
             if not filePath.is_dir() and PurePath(filePath.filename).match(pattern):
                 yield filePath.filename
     
-    def globAndLoad(self, pattern):
-        for filePath in self.glob(pattern):
-            yield filePath, self.readFile(filePath)
+    def loadFile(self, filePath):
+        return filePath, self.readFile(filePath)
+
+    def globAndLoad(self, pattern, workers=None, ordered=True, processes=False):
+        # With workers, matches are decompressed and parsed concurrently on a thread- (or process-) pool,
+        # yielded in glob-order or, with ordered=False, as they complete. Needs a read-only ZipTray.
+        if workers is None:
+            for filePath in self.glob(pattern):
+                yield self.loadFile(filePath)
+            return
+
+        assert self.mode == 'r', "Concurrent loading needs a read-only ZipTray: ZipTray(archivePath, 'r')"
+        workerHandles = []  # Closed once the pool is shut down, its threads are gone by then
+        if processes:
+            executor, load = ProcessPoolExecutor(workers), partial(loadInProcess, self.archivePath)
+        else:
+            executor = ThreadPoolExecutor(workers, initializer=self.openWorkerArchive, initargs=(workerHandles,))
+            load = self.loadFile
+
+        try:
+            with executor:
+                futures = [executor.submit(load, filePath) for filePath in self.glob(pattern)]
+                try:
+                    yield from (f.result() for f in (futures if ordered else as_completed(futures)))
+                finally:
+                    for future in futures:  # Consumer stopped early
+                        future.cancel()
+        finally:
+            for archive in workerHandles:
+                archive.close()
 
     def fileExists(self, filePath):
         try:
-            with self.archive.open(str(filePath)) as _fob:
+            with self.openFile(filePath) as _fob:
                 pass
             return True
         except:
-            return False
\ No newline at end of file
+            return False
+
+    def close(self):
+        for handle in list(self.handles):
+            handle.archive.close()
+        self.archive.close()
@@ -9,6 +9,8 @@ setuptools.setup(
       url='https://github.com/ra-martin/KubunConfector',
       packages=['kubunconfector'],
       install_requires=['typeguard'],
+      extras_require={'columnar': ['numpy']},
+      entry_points={'console_scripts': ['kubunconfector=kubunconfector.cli:main']},
       python_requires='>=3.8',
       setup_requires=['wheel']
 )
\ No newline at end of file